@@ -2,14 +2,24 @@
 
 import io
 import os
-import uuid
+import re
+import sys
+import asyncio
+import time
+import itertools
+import hashlib
 import logging
-from collections import defaultdict
-from typing import List, Dict
-
-import requests
-from fastapi import FastAPI, UploadFile, File, Query, HTTPException
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, List, Dict
+
+import aiofiles
+import httpx
+import orjson
+from fastapi import FastAPI, Request, UploadFile, File, Query, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 
 # Try to use pydub, but DO NOT crash if missing (Py3.13 lacks audioop)
@@ -22,8 +32,19 @@ except Exception as _e:
     AudioSegment = None  # type: ignore
     Sine = None  # type: ignore
 
+# In-process decode/resample (no ffmpeg fork); optional like pydub
+HAVE_SOUNDFILE = True
+try:
+    import numpy as np
+    import soundfile as sf
+    from scipy.signal import resample_poly
+except Exception as _e:
+    HAVE_SOUNDFILE = False
+    np = None  # type: ignore
+    sf = None  # type: ignore
+    resample_poly = None  # type: ignore
+
 # External SDKs
-import assemblyai as aai
 import google.generativeai as genai
 
 # -----------------------------------------------------------------------------
@@ -40,14 +61,14 @@ GEMINI_API_KEY     = os.getenv("GEMINI_API_KEY")
 MURF_API_KEY       = os.getenv("MURF_API_KEY")
 DEFAULT_MURF_VOICE_ID = os.getenv("MURF_VOICE_ID", "en-UK-hazel")
 
-if ASSEMBLYAI_API_KEY:
-    aai.settings.api_key = ASSEMBLYAI_API_KEY
-else:
+if not ASSEMBLYAI_API_KEY:
     log.warning("ASSEMBLYAI_API_KEY is NOT set — STT will fall back.")
 
 if GEMINI_API_KEY:
     genai.configure(api_key=GEMINI_API_KEY)
+    GEMINI_MODEL = genai.GenerativeModel("gemini-1.5-flash")  # reused across requests
 else:
+    GEMINI_MODEL = None
     log.warning("GEMINI_API_KEY is NOT set — LLM will fall back.")
 
 if not MURF_API_KEY:
@@ -55,12 +76,37 @@ if not MURF_API_KEY:
 
 if not HAVE_PYDUB:
     log.warning("pydub/audioop not available (likely Python 3.13). "
-                "Will skip local audio conversions and stitching.")
+                "Will skip pydub-based audio conversion and the fallback tone.")
 
 # -----------------------------------------------------------------------------
 # FastAPI app + CORS + static
 # -----------------------------------------------------------------------------
-app = FastAPI(title="Day 11 — Error Handling Voice Bot")
+class ORJSONResponse(JSONResponse):
+    """JSON via orjson (FastAPI's own ORJSONResponse is deprecated and warns per request)."""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled async client for all Murf/AssemblyAI calls (keeps TLS warm)
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        timeout=120,
+        limits=httpx.Limits(max_keepalive_connections=100),
+    )
+    try:
+        yield
+    finally:
+        await app.state.http.aclose()
+
+
+app = FastAPI(
+    title="Day 11 — Error Handling Voice Bot",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,  # faster JSON for transcripts/history
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -68,6 +114,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Compress JSON replies (long llm_text); GZipMiddleware already skips audio/*
+app.add_middleware(GZipMiddleware, minimum_size=512)
 
 STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
 os.makedirs(STATIC_DIR, exist_ok=True)
@@ -76,11 +124,49 @@ app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 # -----------------------------------------------------------------------------
 # In‑memory chat history (prototype)
 # -----------------------------------------------------------------------------
-CHAT_HISTORY: Dict[str, List[Dict[str, str]]] = defaultdict(list)
+# Bounded: each session keeps its last MAX_TURNS_PER_SESSION messages, and
+# the least recently used session is evicted past MAX_SESSIONS.
+MAX_TURNS_PER_SESSION = 32
+MAX_SESSIONS = 10000
+CHAT_HISTORY: "OrderedDict[str, Deque[Dict[str, str]]]" = OrderedDict()
+
+# Pre-formatted "User: ..." / "Assistant: ..." lines for the LLM prompt,
+# mirroring the last PROMPT_WINDOW messages of CHAT_HISTORY per session.
+PROMPT_WINDOW = 8
+PROMPT_HEADER = "You are a friendly, concise voice assistant. Keep replies under 120 words.\n\n"
+CHAT_PROMPT: Dict[str, Deque[str]] = {}
+
+
+def append_history(session_id: str, role: str, content: str) -> None:
+    dq = CHAT_HISTORY.get(session_id)
+    if dq is None:
+        dq = deque(maxlen=MAX_TURNS_PER_SESSION)
+        CHAT_HISTORY[session_id] = dq
+        CHAT_PROMPT[session_id] = deque(maxlen=PROMPT_WINDOW)
+    dq.append({"role": role, "content": content})
+    who = "User" if role == "user" else "Assistant"
+    CHAT_PROMPT[session_id].append(f"{who}: {content}")
+    CHAT_HISTORY.move_to_end(session_id)
+    while len(CHAT_HISTORY) > MAX_SESSIONS:
+        evicted, _ = CHAT_HISTORY.popitem(last=False)  # oldest session first
+        CHAT_PROMPT.pop(evicted, None)
+
+
+def clear_session(session_id: str) -> None:
+    CHAT_HISTORY.pop(session_id, None)
+    CHAT_PROMPT.pop(session_id, None)
+
+
+def build_prompt(session_id: str) -> str:
+    return PROMPT_HEADER + "\n".join(CHAT_PROMPT.get(session_id, ())) + "\nAssistant:"
 
 # -----------------------------------------------------------------------------
 # Utilities
 # -----------------------------------------------------------------------------
+# Sentence boundary: whitespace after . ? or !
+_SENT_SPLIT_RE = re.compile(r"(?<=[.?!])\s+")
+
+
 def split_text_for_murf(text: str, limit: int = 3000) -> List[str]:
     text = (text or "").strip()
     if not text:
@@ -89,9 +175,7 @@ def split_text_for_murf(text: str, limit: int = 3000) -> List[str]:
         return [text]
 
     out, cur = [], ""
-    import re
-    sentences = re.split(r"(?<=[\.\?\!])\s+", text)
-    for s in sentences:
+    for s in _SENT_SPLIT_RE.split(text):
         if len(cur) + len(s) + (1 if cur else 0) <= limit:
             cur = (cur + " " + s).strip()
         else:
@@ -106,19 +190,75 @@ def split_text_for_murf(text: str, limit: int = 3000) -> List[str]:
     return out
 
 
-def murf_generate_url(text: str, voice_id: str) -> str:
+_ASSEMBLYAI_BASE = "https://api.assemblyai.com/v2"
+
+
+async def assemblyai_transcribe(client: httpx.AsyncClient, audio_bytes: bytes) -> str:
+    """
+    Upload audio to AssemblyAI, start a transcript and poll until it finishes.
+    Uses the REST API on the shared async client so no thread is held while polling.
+    On error, raise; caller will handle fallback.
+    """
+    if not ASSEMBLYAI_API_KEY:
+        raise RuntimeError("ASSEMBLYAI_API_KEY missing")
+
+    headers = {"authorization": ASSEMBLYAI_API_KEY}
+
+    r = await client.post(f"{_ASSEMBLYAI_BASE}/upload", content=audio_bytes, headers=headers)
+    r.raise_for_status()
+    upload_url = r.json()["upload_url"]
+
+    r = await client.post(f"{_ASSEMBLYAI_BASE}/transcript", json={"audio_url": upload_url}, headers=headers)
+    r.raise_for_status()
+    transcript_id = r.json()["id"]
+
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        r = await client.get(f"{_ASSEMBLYAI_BASE}/transcript/{transcript_id}", headers=headers)
+        r.raise_for_status()
+        data = r.json()
+        if data["status"] == "completed":
+            return data.get("text") or ""
+        if data["status"] == "error":
+            raise RuntimeError(f"AssemblyAI failed: {data.get('error')}")
+        await asyncio.sleep(0.5)
+    raise RuntimeError("AssemblyAI transcription timed out")
+
+
+# LRU of (voice_id, text digest) -> (audio_url, created_at). Murf audio URLs
+# are pre-signed and expire, so entries are also dropped after TTS_CACHE_TTL.
+TTS_CACHE_MAXSIZE = 1024
+TTS_CACHE_TTL = 3600.0
+TTS_CACHE: "OrderedDict[tuple, tuple]" = OrderedDict()
+# Configured once; each cache key hashes on a .copy() of it
+_TTS_KEY_HASHER = hashlib.blake2b(digest_size=16)
+
+_MURF_URL = "https://api.murf.ai/v1/speech/generate"
+_MURF_HEADERS_TMPL = {"Content-Type": "application/json"}
+
+
+async def murf_generate_url(
+    client: httpx.AsyncClient, text: str, voice_id: str, use_cache: bool = True
+) -> str:
     """
     Call Murf /v1/speech/generate and return an audio URL.
+    Identical (voice, text) requests are served from TTS_CACHE unless use_cache=False.
     On error, raise; caller will handle fallback.
     """
     if not MURF_API_KEY:
         raise RuntimeError("MURF_API_KEY missing")
 
-    url = "https://api.murf.ai/v1/speech/generate"
-    headers = {
-        "api-key": MURF_API_KEY,
-        "Content-Type": "application/json",
-    }
+    h = _TTS_KEY_HASHER.copy()
+    h.update(text.encode())
+    key = (voice_id, h.digest())
+    hit = TTS_CACHE.get(key) if use_cache else None
+    if hit is not None:
+        if time.monotonic() - hit[1] < TTS_CACHE_TTL:
+            TTS_CACHE.move_to_end(key)
+            return hit[0]
+        del TTS_CACHE[key]
+
+    headers = {**_MURF_HEADERS_TMPL, "api-key": MURF_API_KEY}
     payload = {
         "voiceId": voice_id,
         "text": text,
@@ -126,55 +266,121 @@ def murf_generate_url(text: str, voice_id: str) -> str:
         "sampleRate": 24000,
         "style": "Conversational",
     }
-    r = requests.post(url, headers=headers, json=payload, timeout=120)
+    r = await client.post(_MURF_URL, headers=headers, json=payload)
     if r.status_code != 200:
         raise RuntimeError(f"Murf failed {r.status_code}: {r.text}")
     data = r.json()
     audio_url = data.get("audioFile") or data.get("audioUrl") or data.get("data", {}).get("audioFile")
     if not audio_url:
         raise RuntimeError(f"Murf response missing audio URL: {data}")
+
+    TTS_CACHE[key] = (audio_url, time.monotonic())
+    if len(TTS_CACHE) > TTS_CACHE_MAXSIZE:
+        TTS_CACHE.popitem(last=False)
     return audio_url
 
 
-def download_mp3(url: str):
-    """Return AudioSegment if pydub is present; else return (bytes, 'mp3')."""
-    r = requests.get(url, timeout=120)
-    r.raise_for_status()
-    if HAVE_PYDUB:
-        return AudioSegment.from_file(io.BytesIO(r.content), format="mp3")
-    return r.content, "mp3"
+# Reply file names: per-process shard (pid + random tag fixed at startup, so a
+# restarted worker reusing a pid can't overwrite old replies) + a counter.
+_REPLY_SHARD = f"{os.getpid()}_{os.urandom(2).hex()}"
+_REPLY_COUNTER = itertools.count()
+
+
+def _new_reply_name() -> str:
+    return f"reply_{_REPLY_SHARD}_{next(_REPLY_COUNTER)}.mp3"
+
+
+# Cap parallel Murf requests so multi-part replies don't trip rate limits
+MURF_CONCURRENCY = asyncio.Semaphore(8)
+
+
+async def _fetch_part(client: httpx.AsyncClient, text: str, voice_id: str) -> str:
+    """Generate one Murf part and return its URL (bounded by MURF_CONCURRENCY)."""
+    async with MURF_CONCURRENCY:
+        return await murf_generate_url(client, text, voice_id)
 
 
-def save_audiosegment(seg) -> str:
+async def stream_mp3s_to_static(client: httpx.AsyncClient, urls: List[str]) -> str:
     """
-    Save either an AudioSegment or (bytes, 'mp3') into /static and return /static path.
+    Download Murf MP3 parts in order straight into one file under /static.
+    Every part is requested with the same format/sampleRate, so the MP3 frames
+    can be concatenated byte-for-byte without decoding/re-encoding.
     """
-    out_name = f"reply_{uuid.uuid4().hex}.mp3"
+    out_name = _new_reply_name()
     out_path = os.path.join(STATIC_DIR, out_name)
+    try:
+        async with aiofiles.open(out_path, "wb") as f:
+            for url in urls:
+                async with client.stream("GET", url) as r:
+                    r.raise_for_status()
+                    async for chunk in r.aiter_bytes():
+                        await f.write(chunk)
+    except Exception:
+        # don't leave a truncated reply behind
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        raise
+    return f"/static/{out_name}"
 
-    if HAVE_PYDUB and isinstance(seg, type(AudioSegment.silent())):  # AudioSegment
-        seg.export(out_path, format="mp3")
-    else:
-        # seg is (bytes, 'mp3')
-        data = seg[0] if isinstance(seg, tuple) else seg
-        with open(out_path, "wb") as f:
-            f.write(data)
 
-    return f"/static/{out_name}"
+def _sf_to_wav16k_mono(raw: bytes) -> bytes:
+    """Decode with libsndfile, downmix + resample with numpy/scipy, encode 16 kHz mono WAV."""
+    data, sr = sf.read(io.BytesIO(raw), dtype="float32")
+    if data.ndim > 1:
+        data = data.mean(axis=1)
+    if sr != 16000:
+        g = np.gcd(16000, sr)
+        data = resample_poly(data, 16000 // g, sr // g)
+    buf = io.BytesIO()
+    sf.write(buf, data, 16000, format="WAV", subtype="PCM_16")
+    return buf.getvalue()
 
 
-def fallback_tone_mp3() -> str:
+def _to_wav16k_mono(raw: bytes) -> bytes:
+    """Decode uploaded audio with pydub/ffmpeg and re-encode as 16 kHz mono WAV."""
+    try:
+        audio_in = AudioSegment.from_file(io.BytesIO(raw))
+    except Exception:
+        # MediaRecorder default in browsers is often webm
+        audio_in = AudioSegment.from_file(io.BytesIO(raw), format="webm")
+    wav_io = io.BytesIO()
+    audio_in.set_frame_rate(16000).set_channels(1).export(wav_io, format="wav")
+    return wav_io.getvalue()
+
+
+def _build_fallback_tone() -> str:
     """
-    Generate a short audible tone as a TTS fallback when Murf is unavailable.
-    If pydub is not available, return an empty string (frontend will still show text).
+    Write the static fallback tone to /static once and return its URL.
+    If pydub/ffmpeg is not available, return an empty string (frontend will still show text).
     """
     if not HAVE_PYDUB:
-        log.warning("Cannot generate tone fallback without pydub; returning empty audio_url.")
+        log.warning("Cannot generate tone fallback without pydub; TTS failures return empty audio_url.")
         return ""
-    tone = Sine(440).to_audio_segment(duration=600).apply_gain(-6)  # 0.6s tone
-    silence = AudioSegment.silent(duration=200)
-    combined = tone + silence + tone
-    return save_audiosegment(combined)
+    out_path = os.path.join(STATIC_DIR, "_fallback_tone.mp3")
+    if not os.path.exists(out_path):
+        # export to a per-process temp name first so a failed (or concurrent,
+        # with several workers) ffmpeg run never leaves a truncated tone that
+        # later startups would keep serving
+        tmp_path = f"{out_path}.{os.getpid()}.tmp"
+        try:
+            tone = Sine(440).to_audio_segment(duration=600).apply_gain(-6)  # 0.6s tone
+            silence = AudioSegment.silent(duration=200)
+            (tone + silence + tone).export(tmp_path, format="mp3")
+            os.replace(tmp_path, out_path)
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            log.warning("Could not write fallback tone (%s); TTS failures return empty audio_url.", e)
+            return ""
+    return "/static/_fallback_tone.mp3"
+
+
+FALLBACK_TONE_URL = _build_fallback_tone()
+
+
+def fallback_tone_mp3() -> str:
+    """Audible tone used as a TTS fallback when Murf is unavailable (pre-built at import)."""
+    return FALLBACK_TONE_URL
 
 # -----------------------------------------------------------------------------
 # Health & simple test endpoints
@@ -184,33 +390,35 @@ def health():
     return {"ok": True}
 
 @app.get("/__test/assembly")
-def test_assembly():
+async def test_assembly(request: Request):
     try:
-        r = requests.get(
-            "https://api.assemblyai.com/v2/account",
+        r = await request.app.state.http.get(
+            f"{_ASSEMBLYAI_BASE}/account",
             headers={"Authorization": ASSEMBLYAI_API_KEY or ""},
             timeout=15,
         )
-        return {"ok": r.ok, "status": r.status_code}
+        return {"ok": r.is_success, "status": r.status_code}
     except Exception as e:
         raise HTTPException(500, f"AssemblyAI test failed: {e}")
 
 @app.get("/__test/gemini")
-def test_gemini():
+async def test_gemini():
     try:
-        if not GEMINI_API_KEY:
+        if GEMINI_MODEL is None:
             return {"ok": False, "detail": "GEMINI_API_KEY missing"}
-        model = genai.GenerativeModel("gemini-1.5-flash")
-        out = model.generate_content("Say OK")
+        out = await GEMINI_MODEL.generate_content_async("Say OK")
         text = (getattr(out, "text", None) or out.candidates[0].content.parts[0].text).strip()
         return {"ok": True, "reply": text}
     except Exception as e:
         raise HTTPException(500, f"Gemini test failed: {e}")
 
 @app.get("/__test/murf")
-def test_murf():
+async def test_murf(request: Request):
     try:
-        url = murf_generate_url("This is a Murf test.", DEFAULT_MURF_VOICE_ID)
+        # bypass TTS_CACHE so the probe really reaches Murf
+        url = await murf_generate_url(
+            request.app.state.http, "This is a Murf test.", DEFAULT_MURF_VOICE_ID, use_cache=False
+        )
         return {"ok": True, "audio_url": url}
     except Exception as e:
         raise HTTPException(500, f"Murf test failed: {e}")
@@ -220,58 +428,107 @@ def test_murf():
 # -----------------------------------------------------------------------------
 @app.get("/agent/history/{session_id}")
 def get_history(session_id: str):
-    return {"session_id": session_id, "messages": CHAT_HISTORY.get(session_id, [])}
+    return {"session_id": session_id, "messages": list(CHAT_HISTORY.get(session_id, ()))}
 
 @app.delete("/agent/history/{session_id}")
 def clear_history(session_id: str):
-    CHAT_HISTORY.pop(session_id, None)
+    clear_session(session_id)
     return {"session_id": session_id, "cleared": True}
 
 # -----------------------------------------------------------------------------
 # Main chat endpoint (Day 10 pipeline + Day 11 fallbacks)
 # -----------------------------------------------------------------------------
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024  # 10 MB of recorded audio is plenty
+UPLOAD_CHUNK_BYTES = 64 * 1024
+
+
+class UploadLimitMiddleware:
+    """
+    Reject oversized /agent/chat/ bodies before multipart parsing spools them
+    to disk: by Content-Length up front, else by counting bytes as they arrive.
+    """
+
+    def __init__(self, app, max_body: int):
+        self.app = app
+        self.max_body = max_body
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/agent/chat/"):
+            await self.app(scope, receive, send)
+            return
+
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > self.max_body:
+            response = ORJSONResponse({"detail": "Audio upload too large."}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        seen = 0
+
+        async def limited_receive():
+            nonlocal seen
+            message = await receive()
+            if message["type"] == "http.request":
+                seen += len(message.get("body", b""))
+                if seen > self.max_body:
+                    raise HTTPException(413, "Audio upload too large.")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+# Body cap leaves one chunk of slack for the multipart boundaries/headers
+app.add_middleware(UploadLimitMiddleware, max_body=MAX_UPLOAD_BYTES + UPLOAD_CHUNK_BYTES)
+
+
 @app.post("/agent/chat/{session_id}")
 async def agent_chat(
+    request: Request,
     session_id: str,
     file: UploadFile = File(...),
     voiceId: str | None = Query(default=None, description="Optional Murf voiceId"),
 ):
     """
     Flow:
-      1) Audio -> (WAV 16k mono if pydub available; otherwise raw bytes)
+      1) Audio -> WAV 16k mono (soundfile, else pydub; otherwise raw bytes)
       2) STT (AssemblyAI)  -> fallback transcript if missing
       3) Append 'user' to history
       4) LLM (Gemini) with history -> fallback message if LLM fails
       5) Append 'assistant' to history
-      6) TTS (Murf) -> stitch when pydub is present, else return Murf URL
+      6) TTS (Murf) -> concatenate MP3 parts into one /static file
       7) Return JSON with transcript, llm_text, audio_url
     """
+    client: httpx.AsyncClient = request.app.state.http
     try:
-        raw = await file.read()
+        # UploadLimitMiddleware already capped the request body; this re-checks
+        # the file itself while copying it out of the spooled upload
+        buf = bytearray()
+        while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+            buf.extend(chunk)
+            if len(buf) > MAX_UPLOAD_BYTES:
+                raise HTTPException(413, "Audio upload too large.")
+        raw = bytes(buf)
         if not raw:
             raise HTTPException(400, "No audio data received.")
 
-        # --- 1) Convert to WAV only if pydub exists; else send raw bytes to STT
+        # --- 1) Convert to WAV in-process if possible; else send raw bytes to STT
         wav_bytes = raw
-        if HAVE_PYDUB:
+        converted = False
+        if HAVE_SOUNDFILE:
             try:
-                audio_in = AudioSegment.from_file(io.BytesIO(raw))
-            except Exception:
-                # MediaRecorder default in browsers is often webm
-                audio_in = AudioSegment.from_file(io.BytesIO(raw), format="webm")
-            wav_io = io.BytesIO()
-            audio_in.set_frame_rate(16000).set_channels(1).export(wav_io, format="wav")
-            wav_bytes = wav_io.getvalue()
+                wav_bytes = await asyncio.to_thread(_sf_to_wav16k_mono, raw)
+                converted = True
+            except Exception as e:
+                # libsndfile can't read webm/opus (browser MediaRecorder default)
+                log.info("soundfile decode failed (%s); trying pydub.", e)
+        if not converted and HAVE_PYDUB:
+            wav_bytes = await asyncio.to_thread(_to_wav16k_mono, raw)
 
         # --- 2) STT with fallback ---
         transcript_text = ""
         try:
-            if not ASSEMBLYAI_API_KEY:
-                raise RuntimeError("ASSEMBLYAI_API_KEY missing")
-            transcriber = aai.Transcriber()
             # AssemblyAI accepts bytes; we give it wav if we have it, else raw
-            transcript_obj = transcriber.transcribe(wav_bytes)
-            transcript_text = (transcript_obj.text or "").strip()
+            transcript_text = (await assemblyai_transcribe(client, wav_bytes)).strip()
             if not transcript_text:
                 raise RuntimeError("Empty transcript from STT")
         except Exception as e:
@@ -279,28 +536,15 @@ async def agent_chat(
             transcript_text = "(Sorry, I couldn't transcribe that.)"
 
         # Save user message
-        CHAT_HISTORY[session_id].append({"role": "user", "content": transcript_text})
+        append_history(session_id, "user", transcript_text)
 
         # --- 3) LLM with fallback ---
         llm_text = ""
         try:
-            if not GEMINI_API_KEY:
+            if GEMINI_MODEL is None:
                 raise RuntimeError("GEMINI_API_KEY missing")
-            model = genai.GenerativeModel("gemini-1.5-flash")
-
-            # Build short prompt from last ~8 messages
-            history = CHAT_HISTORY[session_id][-8:]
-            convo_lines = []
-            for m in history:
-                who = "User" if m["role"] == "user" else "Assistant"
-                convo_lines.append(f"{who}: {m['content']}")
-            prompt = (
-                "You are a friendly, concise voice assistant. Keep replies under 120 words.\n\n"
-                + "\n".join(convo_lines)
-                + "\nAssistant:"
-            )
-
-            out = model.generate_content(prompt)
+            # Short prompt from the last ~8 messages (lines kept pre-formatted per session)
+            out = await GEMINI_MODEL.generate_content_async(build_prompt(session_id))
             llm_text = (getattr(out, "text", None) or out.candidates[0].content.parts[0].text).strip()
             if not llm_text:
                 raise RuntimeError("Empty LLM response")
@@ -309,7 +553,7 @@ async def agent_chat(
             llm_text = "I'm having trouble connecting right now. Please try again in a moment."
 
         # Save assistant message
-        CHAT_HISTORY[session_id].append({"role": "assistant", "content": llm_text})
+        append_history(session_id, "assistant", llm_text)
 
         # --- 4) TTS with fallback ---
         audio_url = ""
@@ -317,21 +561,9 @@ async def agent_chat(
             parts = split_text_for_murf(llm_text, 3000)
             voice = voiceId or DEFAULT_MURF_VOICE_ID
 
-            if HAVE_PYDUB:
-                # Download each part, stitch locally, serve from /static
-                segments = []
-                for p in parts:
-                    seg = download_mp3(murf_generate_url(p, voice))
-                    segments.append(seg if HAVE_PYDUB else None)  # type: ignore
-
-                combined = segments[0]
-                for seg in segments[1:]:
-                    combined += seg  # type: ignore
-
-                audio_url = save_audiosegment(combined)
-            else:
-                # No pydub: just return the first Murf URL (frontend supports absolute URLs)
-                audio_url = murf_generate_url(parts[0], voice)
+            # Generate all parts concurrently, then stream them into one /static file
+            urls = await asyncio.gather(*[_fetch_part(client, p, voice) for p in parts])
+            audio_url = await stream_mp3s_to_static(client, urls)
         except Exception as e:
             log.error("TTS error: %s", e)
             # Fallback: short tone if we can, else no audio (text reply still returned)
@@ -348,4 +580,22 @@ async def agent_chat(
         raise
     except Exception as e:
         log.exception("Unexpected server error")
-        raise HTTPException(500, f"Server error: {e}")
\ No newline at end of file
+        raise HTTPException(500, f"Server error: {e}")
+
+
+# -----------------------------------------------------------------------------
+# Entrypoint: python main.py  (pip install uvloop httptools)
+# -----------------------------------------------------------------------------
+if __name__ == "__main__":
+    import uvicorn
+
+    # CHAT_HISTORY lives in process memory, so each worker has its own
+    # sessions; keep WEB_CONCURRENCY=1 unless a client sticks to one worker.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "8000")),
+        loop="asyncio" if sys.platform == "win32" else "uvloop",  # no uvloop on Windows
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+    )